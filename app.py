@@ -6,116 +6,454 @@ Features:
   1. ChatGPT-like conversational UI.
   2. Model selection (e.g. online OpenAI GPT‑3.5‑turbo, local DialoGPT, dummy fallback).
 
+The app is an async (ASGI) Quart application, so slow model calls don't hold up other requests.
+Run it with `python app.py` for development, or `gunicorn app:app` (see gunicorn.conf.py) in production.
+
 Dependencies:
-  - flask
-  - openai
+  - quart
+  - uvicorn
+  - gunicorn  (for production serving)
+  - openai (>= 1.0)
+  - aiohttp
+  - orjson
   - transformers, torch  (for local model)
   
 Set your OpenAI API key in the environment variable OPENAI_API_KEY if using GPT‑3.5‑turbo.
-Ensure the Ollama CLI is installed and available on your PATH.
+For local LLMs, ensure the Ollama server is running (`ollama serve`); set OLLAMA_URL if it isn't on localhost:11434.
 """
 
 import os
-import subprocess  # <-- Used for invoking Ollama models.
-from flask import Flask, render_template_string, request, jsonify
+import gzip
+import time
+import queue
+import asyncio
+import hashlib
+import inspect
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, InvalidStateError
+import aiohttp  # <-- Used for calling the Ollama HTTP API.
+import orjson
+from quart import Quart, Response, abort, request, make_response
 import openai
 
 # Try importing transformers. If not installed, mark local model as unavailable.
 try:
+    import torch
     from transformers import pipeline, Conversation
     TRANSFORMERS_AVAILABLE = True
 except ImportError:
     TRANSFORMERS_AVAILABLE = False
 
-app = Flask(__name__)
+# Redis is optional; when REDIS_URL is set it lets workers share the response cache and chat sessions.
+try:
+    import redis.asyncio as aioredis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+# vLLM is optional; with USE_VLLM=1 it serves DialoGPT with continuous batching instead of transformers.
+try:
+    from vllm import AsyncEngineArgs, AsyncLLMEngine, SamplingParams
+    VLLM_AVAILABLE = True
+except ImportError:
+    VLLM_AVAILABLE = False
+
+USE_VLLM = VLLM_AVAILABLE and os.getenv("USE_VLLM") == "1"
+
+# brotli is optional; when installed, browsers that accept it get brotli- instead of gzip-compressed responses.
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+# sentence-transformers and FAISS are optional; with SEMANTIC_CACHE=1 they let near-duplicate prompts share cached replies.
+try:
+    import faiss
+    from sentence_transformers import SentenceTransformer
+    SEMANTIC_CACHE_AVAILABLE = True
+except ImportError:
+    SEMANTIC_CACHE_AVAILABLE = False
+
+app = Quart(__name__)
+
+# --- Local model pipelines ---
+# Weight precision for DialoGPT. Setting DIALOGPT_DTYPE=bfloat16 halves memory traffic, but is only faster on
+# CPUs with native bf16 instructions (AVX512_BF16 or AMX); elsewhere torch emulates it and it is much slower.
+DIALOGPT_DTYPE = os.getenv("DIALOGPT_DTYPE", "float32")
 
-# --- Initialize local model pipelines ---
-if TRANSFORMERS_AVAILABLE:
-    # Using a conversational pipeline with DialoGPT (local model).
-    dialoGPT_pipeline = pipeline("conversational", model="microsoft/DialoGPT-medium")
-else:
-    dialoGPT_pipeline = None
+# DialoGPT is loaded on first use, so users of the other models never pay for loading its ~1.5GB of weights.
+_dialoGPT_pipeline = None
+_dialoGPT_lock = threading.Lock()
+
+def get_dialoGPT():
+    global _dialoGPT_pipeline
+    with _dialoGPT_lock:
+        if _dialoGPT_pipeline is None:
+            # Using a conversational pipeline with DialoGPT (local model).
+            dialoGPT_pipeline = pipeline(
+                "conversational", model="microsoft/DialoGPT-medium", torch_dtype=getattr(torch, DIALOGPT_DTYPE)
+            )
+            # Batched generation needs a pad token (GPT-2 has none) and left padding so replies follow the prompt.
+            dialoGPT_pipeline.tokenizer.pad_token_id = dialoGPT_pipeline.model.config.eos_token_id
+            dialoGPT_pipeline.tokenizer.padding_side = "left"
+            _dialoGPT_pipeline = dialoGPT_pipeline
+    return _dialoGPT_pipeline
+
+# DialoGPT's context window is 1024 tokens; inputs are trimmed to this budget to leave room for the reply.
+DIALOGPT_MAX_INPUT_TOKENS = 800
+
+def fit_to_token_budget(tokenizer, text, max_tokens):
+    """Drop whole lines from the start of text until it fits in max_tokens (a single line is kept as is)."""
+    while "\n" in text and len(tokenizer.encode(text)) > max_tokens:
+        text = text.split("\n", 1)[1]
+    return text
+
+# With DIALOGPT_PRELOAD=1 the weights are loaded at import instead. Under gunicorn (which preloads the app,
+# see gunicorn.conf.py) that happens once in the master process and the forked workers share the weight
+# pages copy-on-write, rather than each worker loading its own copy. The pipeline stays on the CPU, since
+# GPU memory can't be shared across a fork.
+if TRANSFORMERS_AVAILABLE and not USE_VLLM and os.getenv("DIALOGPT_PRELOAD") == "1":
+    get_dialoGPT()
+
+class DialoGPTBatcher:
+    """
+    Collects concurrent DialoGPT requests into micro-batches so the pipeline runs once per batch.
+    A batch is dispatched when it holds max_batch items or max_wait seconds after its first item arrived.
+    """
+
+    def __init__(self, max_batch=8, max_wait=0.02):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    def submit(self, text):
+        """Queue a conversation input and return a concurrent.futures.Future for its reply."""
+        future = Future()
+        self._queue.put((text, future))
+        self._ensure_worker()
+        return future
+
+    def _ensure_worker(self):
+        # Started on first use rather than at import, so the thread lives in the process serving requests.
+        if self._worker is not None:
+            return
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="dialogpt-batcher", daemon=True)
+                self._worker.start()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        # Drop requests whose callers have gone away (e.g. a disconnected client); the rest can no longer
+        # be cancelled, so their results can always be delivered.
+        return [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+
+    @staticmethod
+    def _deliver(future, result=None, exception=None):
+        try:
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+        except InvalidStateError:
+            pass
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                dialoGPT_pipeline = get_dialoGPT()
+                conversations = [
+                    Conversation(fit_to_token_budget(dialoGPT_pipeline.tokenizer, text, DIALOGPT_MAX_INPUT_TOKENS))
+                    for text, _ in batch
+                ]
+                results = dialoGPT_pipeline(conversations, batch_size=len(conversations))
+            except Exception as e:
+                for _, future in batch:
+                    self._deliver(future, exception=e)
+                continue
+            # A single conversation comes back unwrapped.
+            if not isinstance(results, list):
+                results = [results]
+            for (_, future), result in zip(batch, results):
+                self._deliver(future, result.generated_responses[-1] if result.generated_responses else "No response.")
+
+dialoGPT_batcher = DialoGPTBatcher()
+
+# The vLLM engine is built on first use, inside the running event loop.
+_vllm_engine = None
+
+def get_vllm_engine():
+    global _vllm_engine
+    if _vllm_engine is None:
+        _vllm_engine = AsyncLLMEngine.from_engine_args(AsyncEngineArgs(model="microsoft/DialoGPT-medium"))
+    return _vllm_engine
+
+async def generate_with_vllm(text):
+    """
+    Generate a DialoGPT reply with vLLM.
+    Requests join the engine's running batch at the next decode step, and shared prompt prefixes reuse the KV cache.
+    """
+    engine = get_vllm_engine()
+    # vLLM rejects prompts longer than the model's context, so apply the same token budget as the batcher.
+    tokenizer = await engine.get_tokenizer()
+    loop = asyncio.get_running_loop()
+    text = await loop.run_in_executor(None, fit_to_token_budget, tokenizer, text, DIALOGPT_MAX_INPUT_TOKENS)
+    # DialoGPT marks the end of each turn with the EOS token; greedy decoding keeps replies cacheable.
+    final_output = None
+    async for output in engine.generate(
+        text + "<|endoftext|>", SamplingParams(max_tokens=256, temperature=0), uuid.uuid4().hex
+    ):
+        final_output = output
+    return final_output.outputs[0].text.strip() if final_output and final_output.outputs else "No response."
+
+# Stable system prompt sent first on every OpenAI request, so the provider's prompt caching can reuse the prefix.
+SYSTEM_PROMPT = os.getenv("SYSTEM_PROMPT", "You are a helpful assistant.")
+
+# Sampling temperature for OpenAI; set OPENAI_TEMPERATURE=0 to make replies deterministic (and cacheable).
+OPENAI_TEMPERATURE = float(os.getenv("OPENAI_TEMPERATURE", "1.0"))
+
+# --- OpenAI client ---
+# Created on first use; it reads OPENAI_API_KEY from the environment and pools its connections.
+_openai_client = None
+
+def get_openai_client():
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = openai.AsyncOpenAI()
+    return _openai_client
 
 # --- Define model interface functions ---
-def chat_with_openai(conversation, prompt):
+# Each handler takes (session, prompt), where session is the chat's ChatSession (see below)
+# and already ends with the prompt as its latest user message.
+# Handlers may be plain functions or coroutines; blocking ones are run in a thread pool (see call_model).
+# Failures are returned as "Error ..." replies, except by streaming handlers, which raise StreamError.
+
+class StreamError(Exception):
+    """Raised by a streaming handler when generation fails, possibly after some deltas were already sent."""
+
+async def chat_with_openai(session, prompt):
     """
-    Call the OpenAI ChatCompletion API with the conversation history.
-    Expects conversation as a list of dicts like {"role": "user"/"assistant", "content": "..."}.
+    Call the OpenAI Chat Completions API with the conversation history.
+    session.messages is already in the API's format, so it is sent as is rather than copied.
     """
-    messages = conversation + [{"role": "user", "content": prompt}]
     try:
-        response = openai.ChatCompletion.create(
+        response = await get_openai_client().chat.completions.create(
             model="gpt-3.5-turbo",
-            messages=messages
+            messages=session.messages,
+            temperature=OPENAI_TEMPERATURE
         )
-        reply = response['choices'][0]['message']['content']
+        reply = response.choices[0].message.content
     except Exception as e:
         reply = f"Error calling OpenAI API: {e}"
     return reply
 
-def chat_with_dialoGPT(conversation, prompt):
+async def stream_openai(session, prompt):
+    """
+    Stream the OpenAI Chat Completions reply as it is generated.
+    Yields content deltas so the browser can render tokens as soon as they arrive.
+    """
+    try:
+        stream = await get_openai_client().chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=session.messages,
+            temperature=OPENAI_TEMPERATURE,
+            stream=True
+        )
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                yield delta
+    except Exception as e:
+        raise StreamError(f"Error calling OpenAI API: {e}") from e
+
+# How many recent exchanges (user message + reply) the local models see. Prefill cost grows with the
+# prompt, so long chats are cut to a window instead of sending the whole history every turn.
+MAX_CTX_TURNS = int(os.getenv("MAX_CTX_TURNS", "8"))
+
+def build_prompt(session, max_turns=MAX_CTX_TURNS):
+    """The last max_turns exchanges of the conversation, ending with the new prompt, as a single prompt string."""
+    return session.recent_history(2 * max_turns + 1)
+
+async def chat_with_dialoGPT(session, prompt):
     """
     Call the local DialoGPT model via transformers.
     For simplicity we concatenate the conversation history.
+    Concurrent requests are batched into a single pipeline call by dialoGPT_batcher,
+    or continuously batched by vLLM when USE_VLLM is set.
     """
-    if not dialoGPT_pipeline:
+    if not TRANSFORMERS_AVAILABLE and not USE_VLLM:
         return "DialoGPT model not available. Please install transformers."
     # Combine conversation history into one prompt.
-    combined_history = "\n".join([f"{msg['role']}: {msg['content']}" for msg in conversation])
-    combined_input = (combined_history + "\nuser: " + prompt) if combined_history else prompt
-    conv = Conversation(combined_input)
-    result = dialoGPT_pipeline(conv)
-    reply = result.generated_responses[-1] if result.generated_responses else "No response."
+    combined_input = build_prompt(session)
+    try:
+        if USE_VLLM:
+            reply = await generate_with_vllm(combined_input)
+        else:
+            reply = await asyncio.wrap_future(dialoGPT_batcher.submit(combined_input))
+    except Exception as e:
+        reply = f"Error running DialoGPT: {e}"
     return reply
 
-def chat_with_dummy(conversation, prompt):
+async def chat_with_dummy(session, prompt):
     """A dummy echo model."""
     return f"Dummy response to: {prompt}"
 
 # --- NEW: Define functions to call local LLMs via Ollama ---
+# Models are served by the Ollama daemon's HTTP API; set OLLAMA_URL if it isn't on the default port.
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
+
+# Shared HTTP session, created on first use inside the event loop.
+# Its connector keeps connections to the model servers alive between requests.
+_http_session = None
+
+def get_http_session():
+    global _http_session
+    if _http_session is None:
+        _http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=64),
+            timeout=aiohttp.ClientTimeout(total=120)
+        )
+    return _http_session
+
+async def ollama_generate(model, full_prompt):
+    """Return the complete reply of an Ollama model."""
+    try:
+        async with get_http_session().post(
+            f"{OLLAMA_URL}/api/generate",
+            json={"model": model, "prompt": full_prompt, "stream": False}
+        ) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+        reply = data["response"].strip()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        reply = f"Error running {model}: {e}"
+    return reply
+
+async def ollama_stream(model, full_prompt):
+    """Yield an Ollama model's reply as it is generated; the API sends one JSON object per line."""
+    try:
+        async with get_http_session().post(
+            f"{OLLAMA_URL}/api/generate",
+            json={"model": model, "prompt": full_prompt, "stream": True}
+        ) as resp:
+            resp.raise_for_status()
+            async for line in resp.content:
+                if not line.strip():
+                    continue
+                delta = orjson.loads(line).get("response", "")
+                if delta:
+                    yield delta
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise StreamError(f"Error running {model}: {e}") from e
 
-def chat_with_llama3_2(conversation, prompt):
+async def chat_with_llama3_2(session, prompt):
     """
     Call your local LLM "llama3.2" via Ollama.
     This function concatenates the conversation history into a single prompt.
-    Adjust the command-line arguments if your Ollama installation uses a different syntax.
     """
-    # Combine the conversation history into one string.
-    combined_history = "\n".join([f"{msg['role']}: {msg['content']}" for msg in conversation])
-    full_prompt = (combined_history + "\nuser: " + prompt) if combined_history else prompt
+    return await ollama_generate("llama3.2", build_prompt(session))
 
-    try:
-        # Run the Ollama CLI for model "llama3.2". Adjust the model name as needed.
-        result = subprocess.run(
-            ["ollama", "run", "llama3.2", full_prompt],
-            capture_output=True, text=True, check=True
-        )
-        reply = result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        reply = f"Error running llama3.2: {e.stderr}"
-    return reply
+def stream_llama3_2(session, prompt):
+    return ollama_stream("llama3.2", build_prompt(session))
 
-def chat_with_deepseekr1_7b(conversation, prompt):
+async def chat_with_deepseekr1_7b(session, prompt):
     """
     Call your local LLM "deepseekr1 7b" via Ollama.
     This function concatenates the conversation history into a single prompt.
-    If the model name contains spaces, either adjust the naming or ensure proper quoting.
+    The Ollama model name is "deepseekr1-7b" (using a hyphen instead of a space).
     """
-    combined_history = "\n".join([f"{msg['role']}: {msg['content']}" for msg in conversation])
-    full_prompt = (combined_history + "\nuser: " + prompt) if combined_history else prompt
+    return await ollama_generate("deepseekr1-7b", build_prompt(session))
+
+def stream_deepseekr1_7b(session, prompt):
+    return ollama_stream("deepseekr1-7b", build_prompt(session))
 
+# --- Text Generation Inference (TGI) ---
+# Set TGI_URL to add a model served by a TGI server, whose continuous batching interleaves
+# all users' requests in every decode step. TGI_MODEL_NAME sets its name in the UI.
+TGI_URL = os.getenv("TGI_URL")
+TGI_MODEL_NAME = os.getenv("TGI_MODEL_NAME", "TGI")
+
+# TGI completes raw text, so the assistant's turn is cued and generation stops before the model writes the
+# user's next one. TGI includes the matched stop sequence in its output, so replies have it removed.
+TGI_STOP = "\nuser:"
+
+def tgi_request(session):
+    return {
+        "inputs": build_prompt(session) + "\nassistant:",
+        "parameters": {"max_new_tokens": 512, "stop": [TGI_STOP]}
+    }
+
+def tgi_sendable_length(pending):
+    """
+    How much of the not-yet-sent streamed text can be sent: the tail that could still turn out to be
+    the stop sequence, and any whitespace before it, is held back so the reply is stripped like chat_with_tgi's.
+    """
+    held = 0
+    for k in range(min(len(TGI_STOP), len(pending)), 0, -1):
+        if pending.endswith(TGI_STOP[:k]):
+            held = k
+            break
+    return len(pending[:len(pending) - held].rstrip())
+
+async def chat_with_tgi(session, prompt):
+    """Call the model behind the TGI server at TGI_URL."""
     try:
-        # Note: If your model name contains spaces, you might need to adjust how you pass it.
-        # Here we assume the command-line model name is "deepseekr1-7b" (using a hyphen instead).
-        result = subprocess.run(
-            ["ollama", "run", "deepseekr1-7b", full_prompt],
-            capture_output=True, text=True, check=True
-        )
-        reply = result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        reply = f"Error running deepseekr1 7b: {e.stderr}"
+        async with get_http_session().post(f"{TGI_URL}/generate", json=tgi_request(session)) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+        reply = data["generated_text"].removesuffix(TGI_STOP).strip()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        reply = f"Error calling TGI: {e}"
     return reply
 
+async def stream_tgi(session, prompt):
+    """Yield the TGI model's reply token by token from its Server-Sent Events stream."""
+    pending = ""
+    sent_any = False
+    try:
+        async with get_http_session().post(f"{TGI_URL}/generate_stream", json=tgi_request(session)) as resp:
+            resp.raise_for_status()
+            async for line in resp.content:
+                if not line.startswith(b"data:"):
+                    continue
+                event = orjson.loads(line[5:])
+                # TGI reports failures that happen mid-generation as an event instead of an HTTP status.
+                if "error" in event:
+                    raise StreamError(f"Error calling TGI: {event['error']}")
+                token = event["token"]
+                if token["special"] or not token["text"]:
+                    continue
+                pending += token["text"]
+                if not sent_any:
+                    pending = pending.lstrip()
+                sendable = tgi_sendable_length(pending)
+                if sendable:
+                    yield pending[:sendable]
+                    pending = pending[sendable:]
+                    sent_any = True
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise StreamError(f"Error calling TGI: {e}") from e
+    rest = pending.removesuffix(TGI_STOP).rstrip()
+    if rest:
+        yield rest
+
 # --- Mapping model names to handler functions ---
 MODEL_FUNCTIONS = {
     "OpenAI GPT-3.5-turbo": chat_with_openai,
@@ -125,14 +463,269 @@ MODEL_FUNCTIONS = {
     "Dummy": chat_with_dummy
 }
 
-# Mapping model names to handler functions.
-MODEL_FUNCTIONS = {
-    "OpenAI GPT-3.5-turbo": chat_with_openai,
-    "DialoGPT": chat_with_dialoGPT,
-    "Dummy": chat_with_dummy
+if TGI_URL:
+    MODEL_FUNCTIONS[TGI_MODEL_NAME] = chat_with_tgi
+
+AVAILABLE_MODELS = tuple(MODEL_FUNCTIONS)
+
+# Models that can stream their reply token by token via /chat/stream.
+MODEL_STREAM_FUNCTIONS = {
+    "OpenAI GPT-3.5-turbo": stream_openai,
+    "LLama3.2 (Ollama)": stream_llama3_2,
+    "Deepseekr1 7b (Ollama)": stream_deepseekr1_7b
 }
 
-AVAILABLE_MODELS = list(MODEL_FUNCTIONS.keys())
+if TGI_URL:
+    MODEL_STREAM_FUNCTIONS[TGI_MODEL_NAME] = stream_tgi
+
+STREAMING_MODELS = tuple(model for model in AVAILABLE_MODELS if model in MODEL_STREAM_FUNCTIONS)
+
+# Models that always give the same reply to the same input. Only these are cached,
+# otherwise a sampled reply would be replayed to every later identical prompt.
+DETERMINISTIC_MODELS = {"DialoGPT"}
+if OPENAI_TEMPERATURE == 0:
+    DETERMINISTIC_MODELS.add("OpenAI GPT-3.5-turbo")
+
+# --- Response cache ---
+class LLMCache:
+    """
+    Exact-match cache of model replies keyed on a hash of (model, messages).
+    Entries live in an in-process LRU by default, or in Redis (shared by all workers) when a client is given.
+    """
+
+    def __init__(self, ttl=1800, max_entries=1024, redis_client=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._redis = redis_client
+        self._entries = OrderedDict()  # key -> (reply, stored_at)
+
+    @staticmethod
+    def make_key(model_name, messages):
+        payload = orjson.dumps({'model': model_name, 'messages': messages}, option=orjson.OPT_SORT_KEYS)
+        return "llmcache:" + hashlib.sha256(payload).hexdigest()
+
+    async def get(self, key):
+        if self._redis is not None:
+            try:
+                reply = await self._redis.get(key)
+            except aioredis.RedisError:
+                return None
+            return reply.decode() if reply is not None else None
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        reply, stored_at = entry
+        if time.time() - stored_at > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return reply
+
+    async def set(self, key, reply):
+        if self._redis is not None:
+            try:
+                await self._redis.setex(key, self.ttl, reply)
+            except aioredis.RedisError:
+                pass
+            return
+        self._entries[key] = (reply, time.time())
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+REDIS_URL = os.getenv("REDIS_URL")
+redis_client = aioredis.from_url(REDIS_URL) if REDIS_AVAILABLE and REDIS_URL else None
+
+response_cache = LLMCache(ttl=int(os.getenv("CACHE_TTL", "1800")), redis_client=redis_client)
+
+class SemanticCache:
+    """
+    Reuses a model's reply for prompts that mean the same as an earlier one ("What's the weather?" / "what is the weather").
+    Prompts are embedded with a small sentence-transformers model and matched by cosine similarity in a FAISS
+    index per model. Only opening prompts are cached: later ones depend on the conversation before them.
+    The index lives in process and stops growing at max_entries.
+    """
+
+    def __init__(self, threshold=0.95, encoder_name="all-MiniLM-L6-v2", max_entries=10000):
+        self.threshold = threshold
+        self.encoder_name = encoder_name
+        self.max_entries = max_entries
+        self._encoder = None  # loaded on first use
+        self._indexes = {}  # model name -> (faiss index, replies in index order)
+        self._lock = threading.Lock()
+
+    def _embed(self, text):
+        with self._lock:
+            if self._encoder is None:
+                self._encoder = SentenceTransformer(self.encoder_name)
+        return self._encoder.encode([text], normalize_embeddings=True).astype("float32")
+
+    def lookup(self, model_name, prompt):
+        """Blocking. Return (reply, embedding); reply is None on a miss, and the embedding can be passed to store()."""
+        embedding = self._embed(prompt)
+        with self._lock:
+            entry = self._indexes.get(model_name)
+            if entry is None or entry[0].ntotal == 0:
+                return None, embedding
+            index, replies = entry
+            scores, ids = index.search(embedding, 1)
+        if scores[0][0] >= self.threshold:
+            return replies[ids[0][0]], embedding
+        return None, embedding
+
+    def store(self, model_name, embedding, reply):
+        with self._lock:
+            if model_name not in self._indexes:
+                self._indexes[model_name] = (faiss.IndexFlatIP(embedding.shape[1]), [])
+            index, replies = self._indexes[model_name]
+            if index.ntotal < self.max_entries:
+                index.add(embedding)
+                replies.append(reply)
+
+semantic_cache = SemanticCache(threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))) \
+    if SEMANTIC_CACHE_AVAILABLE and os.getenv("SEMANTIC_CACHE") == "1" else None
+
+# --- Chat sessions ---
+class ChatSession:
+    """
+    The conversation of one chat, kept on the server so the client only sends each new prompt.
+    messages is a list of dicts like {"role": "system"/"user"/"assistant", "content": "..."} starting with
+    the system prompt, ready to send to OpenAI. history_str is the user and assistant messages rendered as
+    "role: content" lines for the local models, extended as messages are added rather than re-joined on
+    every request. line_offsets records where each message's line starts in history_str, so a window of
+    recent messages is a single slice.
+    """
+
+    def __init__(self, session_id, messages=None, history_str=None):
+        self.session_id = session_id
+        self.messages = messages if messages is not None else [{"role": "system", "content": SYSTEM_PROMPT}]
+        if history_str is None:
+            history_str = "\n".join([f"{msg['role']}: {msg['content']}" for msg in self.messages
+                                     if msg['role'] != "system"])
+        self.history_str = history_str
+        self.line_offsets = []
+        offset = 0
+        for msg in self.messages:
+            if msg['role'] != "system":
+                self.line_offsets.append(offset)
+                offset += len(msg['role']) + len(msg['content']) + 3  # "role: content\n"
+
+    def add_message(self, role, content):
+        self.messages.append({"role": role, "content": content})
+        line = f"{role}: {content}"
+        if self.history_str:
+            self.line_offsets.append(len(self.history_str) + 1)
+            self.history_str = self.history_str + "\n" + line
+        else:
+            self.line_offsets.append(0)
+            self.history_str = line
+
+    def remove_last_message(self):
+        """Undo the latest add_message."""
+        self.messages.pop()
+        offset = self.line_offsets.pop()
+        self.history_str = self.history_str[:max(offset - 1, 0)]
+
+    def recent_history(self, max_messages):
+        """The last max_messages lines of history_str."""
+        if len(self.line_offsets) <= max_messages:
+            return self.history_str
+        return self.history_str[self.line_offsets[-max_messages]:]
+
+class SessionStore:
+    """
+    Stores chat sessions by id. Sessions live in an in-process LRU by default, or in Redis when a client is given,
+    which is needed when several workers serve the same chat.
+    """
+
+    def __init__(self, ttl=86400, max_sessions=10000, redis_client=None):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._redis = redis_client
+        self._sessions = OrderedDict()  # session_id -> ChatSession
+
+    async def get(self, session_id):
+        """Return the session with this id, starting a new one if it doesn't exist (or has expired)."""
+        if self._redis is not None:
+            stored = await self._redis.get("session:" + session_id)
+            if stored is None:
+                return ChatSession(session_id)
+            stored = orjson.loads(stored)
+            return ChatSession(session_id, stored["messages"], stored["history_str"])
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = ChatSession(session_id)
+        return session
+
+    async def save(self, session):
+        if self._redis is not None:
+            stored = {"messages": session.messages, "history_str": session.history_str}
+            await self._redis.set("session:" + session.session_id, orjson.dumps(stored), ex=self.ttl)
+            return
+        self._sessions[session.session_id] = session
+        self._sessions.move_to_end(session.session_id)
+        if len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+session_store = SessionStore(redis_client=redis_client)
+
+async def load_session(data):
+    # Requests without a usable session id start a new conversation; the chat routes hand its id back to the client.
+    session_id = data.get('session_id')
+    if not isinstance(session_id, str) or not 0 < len(session_id) <= 64:
+        session_id = uuid.uuid4().hex
+    return await session_store.get(session_id)
+
+async def call_model(model_func, session, prompt):
+    """
+    Run a model handler without blocking the event loop.
+    Coroutine handlers are awaited directly; blocking ones run in the default executor.
+    """
+    if inspect.iscoroutinefunction(model_func):
+        return await model_func(session, prompt)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, model_func, session, prompt)
+
+async def cache_lookup(model_name, session, prompt):
+    """
+    Look a prompt up in the response caches. Returns (reply, cache_slot): reply is None on a miss, and
+    cache_slot tells cache_store where the model's reply belongs (None when it shouldn't be cached).
+    """
+    if model_name not in DETERMINISTIC_MODELS:
+        return None, None
+    cache_key = LLMCache.make_key(model_name, session.messages)
+    reply = await response_cache.get(cache_key)
+    if reply is not None:
+        return reply, None
+    embedding = None
+    # The semantic cache only matches opening prompts: the session holds just the system prompt and this prompt.
+    if semantic_cache is not None and len(session.messages) == 2:
+        # Embedding the prompt is CPU work, so keep it off the event loop.
+        loop = asyncio.get_running_loop()
+        reply, embedding = await loop.run_in_executor(None, semantic_cache.lookup, model_name, prompt)
+        if reply is not None:
+            return reply, None
+    return None, (cache_key, embedding)
+
+async def cache_store(model_name, cache_slot, reply):
+    # Handlers report failures as "Error ..." replies; don't let those stick in the cache.
+    if cache_slot is None or reply.startswith("Error"):
+        return
+    cache_key, embedding = cache_slot
+    await response_cache.set(cache_key, reply)
+    if embedding is not None:
+        semantic_cache.store(model_name, embedding, reply)
+
+async def get_reply(model_name, session, prompt):
+    """Answer from the response caches when possible, otherwise call the model (and cache its reply)."""
+    reply, cache_slot = await cache_lookup(model_name, session, prompt)
+    if reply is not None:
+        return reply
+    # Select the handler; default to dummy if not found.
+    model_func = MODEL_FUNCTIONS.get(model_name, chat_with_dummy)
+    reply = await call_model(model_func, session, prompt)
+    await cache_store(model_name, cache_slot, reply)
+    return reply
 
 # --- HTML + JavaScript for the Chat UI ---
 INDEX_HTML = '''
@@ -176,7 +769,10 @@ INDEX_HTML = '''
     const chatLog = document.getElementById('chat-log');
     const userInput = document.getElementById('user-input');
     const modelSelect = document.getElementById('model-select');
-    let conversation = [];  // Holds the conversation as an array of {role, content}
+    const streamingModels = {{ streaming_models|tojson }};
+    // Identifies this chat to the server, which keeps the conversation history.
+    const sessionId = (window.crypto && crypto.randomUUID) ? crypto.randomUUID()
+        : Date.now().toString(36) + Math.random().toString(36).slice(2);
 
     function appendMessage(role, text) {
         const msgDiv = document.createElement('div');
@@ -188,26 +784,58 @@ INDEX_HTML = '''
         chatLog.scrollTop = chatLog.scrollHeight;
     }
 
+    // Read Server-Sent Events from /chat/stream, appending each delta to the placeholder message.
+    async function streamReply(payload) {
+        const response = await fetch('/chat/stream', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify(payload)
+        });
+        const p = chatLog.lastChild.querySelector('p');
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let reply = '';
+        while (true) {
+            const {done, value} = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, {stream: true});
+            const events = buffer.split('\n\n');
+            buffer = events.pop();
+            for (const event of events) {
+                if (!event.startsWith('data: ')) continue;
+                reply += JSON.parse(event.slice(6)).delta;
+                p.innerText = reply;
+                chatLog.scrollTop = chatLog.scrollHeight;
+            }
+        }
+        return reply;
+    }
+
     async function sendMessage() {
         const text = userInput.value.trim();
         if (!text) return;
         appendMessage('user', text);
-        conversation.push({role: 'user', content: text});
         userInput.value = '';
         // Add a temporary typing indicator.
         appendMessage('assistant', '...');
         const model = modelSelect.value;
+        const payload = {session_id: sessionId, prompt: text, model: model};
         try {
-            const response = await fetch('/chat', {
-                method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify({conversation: conversation, prompt: text, model: model})
-            });
-            const data = await response.json();
-            // Remove the temporary message.
-            chatLog.removeChild(chatLog.lastChild);
-            appendMessage('assistant', data.reply);
-            conversation.push({role: 'assistant', content: data.reply});
+            if (streamingModels.includes(model)) {
+                // Tokens replace the typing indicator in place as they arrive.
+                await streamReply(payload);
+            } else {
+                const response = await fetch('/chat', {
+                    method: 'POST',
+                    headers: {'Content-Type': 'application/json'},
+                    body: JSON.stringify(payload)
+                });
+                const data = await response.json();
+                // Remove the temporary message.
+                chatLog.removeChild(chatLog.lastChild);
+                appendMessage('assistant', data.reply);
+            }
         } catch (err) {
             console.error(err);
             chatLog.removeChild(chatLog.lastChild);
@@ -224,24 +852,183 @@ INDEX_HTML = '''
 </html>
 '''
 
-# --- Flask Routes ---
-@app.route('/')
-def index():
-    return render_template_string(INDEX_HTML, models=AVAILABLE_MODELS)
+# The page only depends on the model lists, so it is compiled at import and rendered and encoded once
+# at startup. Every request is then served the same bytes, which browsers may cache too.
+# It is also compressed once per encoding, at the highest levels, since that cost is only paid at startup.
+_INDEX_TEMPLATE = app.jinja_env.from_string(INDEX_HTML)
+_index_pages = {}  # content encoding (None for identity) -> body
 
-@app.route('/chat', methods=['POST'])
-def chat():
-    data = request.get_json()
-    conversation_history = data.get('conversation', [])
+@app.before_serving
+async def render_index_page():
+    html = await _INDEX_TEMPLATE.render_async(models=AVAILABLE_MODELS, streaming_models=STREAMING_MODELS)
+    page = html.encode("utf-8")
+    _index_pages[None] = page
+    _index_pages['gzip'] = gzip.compress(page, 9)
+    if BROTLI_AVAILABLE:
+        _index_pages['br'] = brotli.compress(page, quality=11)
+
+# --- Response compression ---
+# Responses smaller than this aren't worth compressing.
+COMPRESS_MIN_SIZE = 500
+
+def accepted_encoding():
+    """The best content encoding the client accepts: brotli, then gzip, or None."""
+    # Accept-Encoding is a list like "gzip, br;q=0.8, *;q=0"; q=0 means the encoding is refused.
+    weights = {}
+    for item in request.headers.get('Accept-Encoding', '').split(','):
+        name, _, params = item.partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key.lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name.strip().lower()] = q
+    # An encoding that isn't listed takes the weight of "*", if there is one.
+    candidates = ['br', 'gzip'] if BROTLI_AVAILABLE else ['gzip']
+    for encoding in candidates:
+        if weights.get(encoding, weights.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+def compressed_response(body, mimetype, encoding, headers=None):
+    headers = dict(headers or {}, Vary='Accept-Encoding')
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return Response(body, mimetype=mimetype, headers=headers)
+
+# --- Routes ---
+# Request and response bodies go through orjson, which is several times faster than the stdlib json module
+# on the long conversation payloads these routes handle.
+async def read_json():
+    # Every route takes a JSON object; anything else is a malformed request.
+    try:
+        data = orjson.loads(await request.get_data())
+    except orjson.JSONDecodeError:
+        abort(400)
+    if not isinstance(data, dict):
+        abort(400)
+    return data
+
+def read_chat_fields(data):
+    """
+    The prompt and model name of a chat request. Both must be strings: the prompt is stored in the
+    session, so a bad value would break every later turn of the chat rather than just this request.
+    """
     prompt = data.get('prompt', '')
     model_name = data.get('model', 'Dummy')
-    # Select the handler; default to dummy if not found.
-    model_func = MODEL_FUNCTIONS.get(model_name, chat_with_dummy)
-    reply = model_func(conversation_history, prompt)
-    return jsonify({'reply': reply})
+    if not isinstance(prompt, str) or not isinstance(model_name, str):
+        abort(400)
+    return prompt, model_name
+
+def json_response(payload):
+    # Replies are natural language and compress well. Streams are left alone, since compressing
+    # them would buffer the tokens the client is waiting for.
+    body = orjson.dumps(payload)
+    encoding = accepted_encoding() if len(body) >= COMPRESS_MIN_SIZE else None
+    if encoding == 'br':
+        body = brotli.compress(body, quality=5)
+    elif encoding == 'gzip':
+        body = gzip.compress(body, 6)
+    return compressed_response(body, 'application/json', encoding)
+
+def sse_event(delta):
+    return b"data: " + orjson.dumps({'delta': delta}) + b"\n\n"
+
+@app.route('/')
+async def index():
+    encoding = accepted_encoding()
+    return compressed_response(_index_pages[encoding], 'text/html', encoding,
+                               headers={'Cache-Control': 'public, max-age=3600'})
+
+@app.route('/chat', methods=['POST'])
+async def chat():
+    data = await read_json()
+    prompt, model_name = read_chat_fields(data)
+    session = await load_session(data)
+    session.add_message("user", prompt)
+    reply = await get_reply(model_name, session, prompt)
+    session.add_message("assistant", reply)
+    await session_store.save(session)
+    return json_response({'reply': reply, 'session_id': session.session_id})
+
+@app.route('/chat/compare', methods=['POST'])
+async def chat_compare():
+    """
+    Ask several models the same prompt at once and return every reply.
+    The calls run concurrently, so this takes as long as the slowest model rather than the sum of all of them.
+    The comparison isn't added to the conversation.
+    """
+    data = await read_json()
+    prompt, _ = read_chat_fields(data)
+    session = await load_session(data)
+    models = data.get('models', AVAILABLE_MODELS)
+    if not isinstance(models, (list, tuple)) or not all(isinstance(name, str) for name in models):
+        abort(400)
+    model_names = [name for name in models or AVAILABLE_MODELS if name in MODEL_FUNCTIONS]
+    # Handlers only read the session, so all models can share one copy that ends with the prompt.
+    compare_session = ChatSession(session.session_id, list(session.messages), session.history_str)
+    compare_session.add_message("user", prompt)
+    # One model failing must not cancel the others, so collect exceptions as that model's reply.
+    results = await asyncio.gather(*[get_reply(name, compare_session, prompt) for name in model_names],
+                                   return_exceptions=True)
+    replies = {name: f"Error running {name}: {result}" if isinstance(result, BaseException) else result
+               for name, result in zip(model_names, results)}
+    return json_response({'replies': replies})
+
+@app.route('/chat/stream', methods=['POST'])
+async def chat_stream():
+    data = await read_json()
+    prompt, model_name = read_chat_fields(data)
+    session = await load_session(data)
+    stream_func = MODEL_STREAM_FUNCTIONS.get(model_name)
+    session.add_message("user", prompt)
+
+    async def generate():
+        cached, cache_slot = await cache_lookup(model_name, session, prompt) if stream_func else (None, None)
+        if cached is not None:
+            reply = cached
+            yield sse_event(cached)
+        elif stream_func:
+            deltas = []
+            try:
+                async for delta in stream_func(session, prompt):
+                    deltas.append(delta)
+                    yield sse_event(delta)
+            except StreamError as e:
+                # Show the error after whatever was already streamed. The failed turn is dropped from the
+                # conversation, so neither the partial reply nor the prompt is saved, and nothing is cached.
+                yield sse_event("\n\n" + str(e) if deltas else str(e))
+                session.remove_last_message()
+                return
+            reply = "".join(deltas)
+            await cache_store(model_name, cache_slot, reply)
+        else:
+            # Models without a streaming handler send their whole reply as a single event.
+            reply = await get_reply(model_name, session, prompt)
+            yield sse_event(reply)
+        session.add_message("assistant", reply)
+        await session_store.save(session)
+
+    response = await make_response(generate(), {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+        'X-Session-Id': session.session_id
+    })
+    # Generation can outlast Quart's default response timeout.
+    response.timeout = None
+    return response
+
+@app.after_serving
+async def close_http_session():
+    if _http_session is not None:
+        await _http_session.close()
 
 # --- Main entry point ---
 if __name__ == '__main__':
-    # Set OpenAI API key from environment variable if available.
-    openai.api_key = os.getenv("OPENAI_API_KEY")
-    app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
+    # Single-process development server; use `gunicorn app:app` to run several workers.
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=5000)
@@ -0,0 +1,44 @@
+"""
+Gunicorn settings for serving app.py in production: `gunicorn app:app`.
+
+Gunicorn manages several worker processes; each runs the ASGI app on a uvicorn event loop,
+so every worker keeps many model calls in flight at once.
+"""
+
+import gc
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+# Chat sessions live in each worker's memory unless REDIS_URL is set, and a chat's turns land on random
+# workers. So run several workers only when Redis is there to share the sessions.
+workers = int(os.getenv("WEB_CONCURRENCY", "4" if os.getenv("REDIS_URL") else "1"))
+
+# With USE_VLLM=1 each worker would start its own vLLM engine on the GPU, and each engine reserves most
+# of the GPU's memory, so every worker after the first would fail. A single worker serves all requests;
+# the engine's continuous batching handles the concurrency.
+if os.getenv("USE_VLLM") == "1":
+    workers = 1
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Local model replies can take a while; don't let gunicorn treat a busy worker as hung.
+timeout = 120
+graceful_timeout = 30
+
+# Import the app once in the master before forking workers. With DIALOGPT_PRELOAD=1 this loads DialoGPT's
+# weights there too, and the workers share those read-only pages copy-on-write instead of each holding a copy.
+preload_app = True
+
+
+def when_ready(server):
+    # Exempt everything loaded so far from garbage collection. Otherwise the collector's writes to object
+    # headers gradually copy the shared pages into every worker.
+    gc.freeze()
+
+
+def on_starting(server):
+    if server.cfg.workers > 1 and not os.getenv("REDIS_URL"):
+        server.log.warning(
+            "Running %d workers without REDIS_URL: each worker keeps its own chat sessions, "
+            "so conversations will lose their history. Set REDIS_URL or use a single worker.",
+            server.cfg.workers
+        )